@@ -1,9 +1,15 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
+import json
 import re
 from urllib.parse import urlparse
 
 
+# Fallback for Supabase hosts that are not db.* or *.pooler.* style
+_GENERIC_SUPABASE_HOST_RE = re.compile(r'([^.]+)\.supabase\.(co|com)')
+
+
 class Settings(BaseSettings):
     # Database connection string
     database_url: str
@@ -13,6 +19,9 @@ class Settings(BaseSettings):
     supabase_key: Optional[str] = None
     supabase_service_role_key: Optional[str] = None
     
+    # Allowed CORS origins, as a comma-separated or JSON list
+    cors_origins: str = "http://localhost:3000"
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -26,6 +35,14 @@ class Settings(BaseSettings):
                 self.database_url
             )
     
+    @property
+    def cors_origins_list(self) -> List[str]:
+        """Parse CORS_ORIGINS into a list of origins."""
+        value = self.cors_origins.strip()
+        if value.startswith('['):
+            return json.loads(value)
+        return [origin.strip() for origin in value.split(',') if origin.strip()]
+    
     @staticmethod
     def _extract_supabase_url_from_connection_string(connection_string: str) -> str:
         """Extract Supabase project URL from PostgreSQL connection string."""
@@ -38,23 +55,21 @@ class Settings(BaseSettings):
             
             # Handle different Supabase connection string formats
             if 'supabase.co' in host or 'supabase.com' in host:
+                parts = host.split('.')
+                
                 # Format 1: db.xxxxx.supabase.co
-                match = re.search(r'db\.([^.]+)\.supabase\.co', host)
-                if match:
-                    return f"https://{match.group(1)}.supabase.co"
+                if len(parts) == 4 and parts[0] == 'db' and parts[2:] == ['supabase', 'co']:
+                    return f"https://{parts[1]}.supabase.co"
                 
                 # Format 2: postgres.xxxxx.pooler.supabase.com
-                match = re.search(r'postgres\.([^.]+)\.pooler\.supabase\.com', host)
-                if match:
-                    return f"https://{match.group(1)}.supabase.co"
-                
                 # Format 3: xxxxx.pooler.supabase.com
-                match = re.search(r'([^.]+)\.pooler\.supabase\.com', host)
-                if match:
-                    return f"https://{match.group(1)}.supabase.co"
+                if len(parts) >= 4 and parts[-3:] == ['pooler', 'supabase', 'com']:
+                    if len(parts) == 5 and parts[0] == 'postgres':
+                        return f"https://{parts[1]}.supabase.co"
+                    return f"https://{parts[-4]}.supabase.co"
                 
                 # Format 4: Try to extract any subdomain before supabase.co/com
-                match = re.search(r'([^.]+)\.supabase\.(co|com)', host)
+                match = _GENERIC_SUPABASE_HOST_RE.search(host)
                 if match:
                     project_ref = match.group(1)
                     if project_ref not in ['db', 'postgres', 'pooler']:
@@ -68,5 +83,8 @@ class Settings(BaseSettings):
             raise ValueError(f"Error parsing connection string: {str(e)}")
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Return the application settings, parsing the environment only once."""
+    return Settings()
 
@@ -1,9 +1,9 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from app.config import settings
+from app.config import get_settings
 
 # Convert postgresql:// to postgresql+asyncpg:// for async SQLAlchemy
-database_url = settings.database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+database_url = get_settings().database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
 
 # Create async engine
 engine = create_async_engine(
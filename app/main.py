@@ -1,20 +1,45 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from app.config import get_settings
 from app.routers import users, events, storage
+from app.services.http import get_http_client, close_http_client, drain_background_tasks
+
+
+# Seconds shutdown waits for background uploads and cleanups before cancelling them
+BACKGROUND_SHUTDOWN_TIMEOUT = 30.0
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared resources on startup and release them on shutdown."""
+    # One pooled client for all Supabase calls, reused across requests
+    get_http_client()
+    try:
+        yield
+    finally:
+        # Let background work finish on the open client before closing it
+        await drain_background_tasks(BACKGROUND_SHUTDOWN_TIMEOUT)
+        await close_http_client()
+
 
 app = FastAPI(
     title="Learning Management System API",
     description="API server for Learning Management System",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # In production, replace with specific origins
+    allow_origins=get_settings().cors_origins_list,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,  # Let browsers cache preflight responses for a day
 )
 
 # Include routers
@@ -1,13 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query, Response
 from app.services.event_service import EventService
 from app.models.event import EventCreate, EventUpdate, EventResponse
 from typing import List
+from functools import lru_cache
 
 router = APIRouter(prefix="/api/events", tags=["events"])
 
 
+@lru_cache(maxsize=1)
 def get_event_service() -> EventService:
-    """Dependency to get event service instance."""
+    """Dependency to get the shared event service instance."""
     return EventService()
 
 
@@ -22,12 +24,15 @@ async def create_event(
 
 @router.get("", response_model=List[EventResponse])
 async def get_all_events(
+    response: Response,
     skip: int = Query(0, ge=0, description="Number of events to skip"),
     limit: int = Query(100, ge=1, le=1000, description="Maximum number of events to return"),
     upcoming_only: bool = Query(False, description="Filter to show only upcoming events"),
     event_service: EventService = Depends(get_event_service)
 ):
     """Get all events with optional filtering."""
+    # Allow proxies to coalesce identical list requests
+    response.headers["Cache-Control"] = "max-age=30"
     return await event_service.get_all_events(
         skip=skip,
         limit=limit,
@@ -1,21 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query, Response
 from app.services.storage_service import StorageService
 from typing import Optional
+from functools import lru_cache
 
 router = APIRouter(prefix="/api/storage", tags=["storage"])
 
 
+@lru_cache(maxsize=1)
 def get_storage_service() -> StorageService:
-    """Dependency to get storage service instance."""
+    """Dependency to get the shared storage service instance."""
     return StorageService()
 
 
-@router.post("/upload-image", status_code=status.HTTP_200_OK)
+# OpenAPI description of the wait=false response of the upload endpoints
+_UPLOAD_ACCEPTED_RESPONSE = {
+    status.HTTP_202_ACCEPTED: {
+        "description": "Upload accepted (wait=false); poll /api/storage/uploads/{job_id} for the result",
+        "content": {
+            "application/json": {
+                "example": {
+                    "success": True,
+                    "job_id": "4f1c2a9e8b7d4c3a9f0e1d2c3b4a5968",
+                    "status": "accepted",
+                    "filename": "photo.png",
+                    "content_type": "image/png"
+                }
+            }
+        }
+    }
+}
+
+
+@router.post("/upload-image", status_code=status.HTTP_200_OK, responses=_UPLOAD_ACCEPTED_RESPONSE)
 async def upload_image(
+    response: Response,
     file: UploadFile = File(..., description="Image file to upload"),
     bucket_name: str = Query(..., description="Supabase storage bucket name"),
     folder: Optional[str] = Query(None, description="Optional folder path within the bucket"),
     max_size: Optional[int] = Query(None, description="Maximum file size in bytes (default: 10MB)"),
+    wait: bool = Query(True, description="Wait for the upload to finish; false returns 202 with a job id"),
     storage_service: StorageService = Depends(get_storage_service)
 ):
     """
@@ -25,10 +48,28 @@ async def upload_image(
     - **bucket_name**: Name of the Supabase Storage bucket
     - **folder**: Optional folder path (e.g., "events", "users")
     - **max_size**: Maximum file size in bytes (default: 10MB)
+    - **wait**: Set to false to get a job id immediately and poll `/api/storage/uploads/{job_id}`
     
     Returns the public URL of the uploaded image.
     """
     try:
+        if not wait:
+            job_id, content_type = await storage_service.submit_upload(
+                file=file,
+                bucket_name=bucket_name,
+                folder=folder,
+                max_size=max_size,
+                image_only=True
+            )
+            response.status_code = status.HTTP_202_ACCEPTED
+            return {
+                "success": True,
+                "job_id": job_id,
+                "status": "accepted",
+                "filename": file.filename,
+                "content_type": content_type
+            }
+        
         image_url = await storage_service.upload_image(
             file=file,
             bucket_name=bucket_name,
@@ -51,12 +92,14 @@ async def upload_image(
         )
 
 
-@router.post("/upload-file", status_code=status.HTTP_200_OK)
+@router.post("/upload-file", status_code=status.HTTP_200_OK, responses=_UPLOAD_ACCEPTED_RESPONSE)
 async def upload_file(
+    response: Response,
     file: UploadFile = File(..., description="File to upload"),
     bucket_name: str = Query(..., description="Supabase storage bucket name"),
     folder: Optional[str] = Query(None, description="Optional folder path within the bucket"),
     max_size: Optional[int] = Query(None, description="Maximum file size in bytes (default: 10MB)"),
+    wait: bool = Query(True, description="Wait for the upload to finish; false returns 202 with a job id"),
     storage_service: StorageService = Depends(get_storage_service)
 ):
     """
@@ -66,10 +109,28 @@ async def upload_file(
     - **bucket_name**: Name of the Supabase Storage bucket
     - **folder**: Optional folder path (e.g., "documents", "videos")
     - **max_size**: Maximum file size in bytes (default: 10MB)
+    - **wait**: Set to false to get a job id immediately and poll `/api/storage/uploads/{job_id}`
     
     Returns the public URL of the uploaded file.
     """
     try:
+        if not wait:
+            job_id, content_type = await storage_service.submit_upload(
+                file=file,
+                bucket_name=bucket_name,
+                folder=folder,
+                max_size=max_size,
+                image_only=False
+            )
+            response.status_code = status.HTTP_202_ACCEPTED
+            return {
+                "success": True,
+                "job_id": job_id,
+                "status": "accepted",
+                "filename": file.filename,
+                "content_type": content_type
+            }
+        
         file_url = await storage_service.upload_file(
             file=file,
             bucket_name=bucket_name,
@@ -92,6 +153,29 @@ async def upload_file(
         )
 
 
+@router.get("/uploads/{job_id}", status_code=status.HTTP_200_OK)
+async def get_upload_job(
+    job_id: str,
+    storage_service: StorageService = Depends(get_storage_service)
+):
+    """
+    Get the status of a background upload started with `wait=false`.
+    
+    - **job_id**: Job id returned by the upload endpoint
+    
+    Returns the job status ("accepted", "completed" or "failed") and, once completed, the public URL.
+    """
+    job = storage_service.get_upload_job(job_id)
+    
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload job not found"
+        )
+    
+    return job
+
+
 @router.delete("/delete", status_code=status.HTTP_200_OK)
 async def delete_file(
     file_url: str = Query(..., description="Public URL of the file to delete"),
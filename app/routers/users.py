@@ -2,12 +2,14 @@ from fastapi import APIRouter, Depends
 from app.services.user_service import UserService
 from app.models.user import UserCreate, UserUpdate, UserResponse, UserLogin, TokenResponse
 from fastapi import status
+from functools import lru_cache
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
 
+@lru_cache(maxsize=1)
 def get_user_service() -> UserService:
-    """Dependency to get user service instance."""
+    """Dependency to get the shared user service instance."""
     return UserService()
 
 
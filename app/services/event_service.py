@@ -1,115 +1,171 @@
-from typing import List, Optional
-import httpx
+from typing import List, Optional, Tuple
+from collections import OrderedDict
+import logging
+import orjson
 from app.models.event import EventCreate, EventUpdate, EventResponse
 from app.services.storage_service import StorageService
-from app.config import settings
+from app.services.http import get_http_client, read_json, run_in_background
+from app.config import get_settings
 from fastapi import HTTPException, status
+from pydantic import TypeAdapter
 from datetime import datetime
 
 
+logger = logging.getLogger(__name__)
+
+# Validators built once and reused for every response; validate_json parses
+# and validates the raw response body in a single pass
+_EVENT_ADAPTER = TypeAdapter(EventResponse)
+_EVENT_LIST_ADAPTER = TypeAdapter(List[EventResponse])
+
+
+def _compile_payload_builder(model, exclude_unset: bool = False, not_null: Tuple[str, ...] = ()):
+    """Generate a function that copies a model's fields into a payload dict.
+
+    The field list is inlined into the generated source, so building a payload
+    is plain attribute access with no per-request model introspection. With
+    exclude_unset, fields in not_null are also skipped when they are None.
+    """
+    fields = list(model.model_fields)
+    if exclude_unset:
+        lines = ["def build(e):", "    s = e.model_fields_set", "    p = {}"]
+        for name in fields:
+            check = f"{name!r} in s"
+            if name in not_null:
+                check += f" and e.{name} is not None"
+            lines.append(f"    if {check}: p[{name!r}] = e.{name}")
+        lines.append("    return p")
+    else:
+        items = ", ".join(f"{name!r}: e.{name}" for name in fields)
+        lines = ["def build(e):", f"    return {{{items}}}"]
+
+    namespace = {}
+    exec(compile("\n".join(lines), f"<{model.__name__} payload builder>", "exec"), namespace)
+    return namespace["build"]
+
+
+_build_create_payload = _compile_payload_builder(EventCreate)
+# name and date are NOT NULL columns, so an explicit null leaves them unchanged
+_build_update_payload = _compile_payload_builder(
+    EventUpdate, exclude_unset=True, not_null=("name", "date")
+)
+
+
 class EventService:
+    # Maximum number of events whose ETag and body are kept for conditional GETs
+    ETAG_CACHE_SIZE = 1024
+
     def __init__(self):
+        settings = get_settings()
         self.supabase_url = settings.supabase_url
         self.supabase_key = settings.supabase_key
         self.service_role_key = settings.supabase_service_role_key
+        if not self.supabase_url or not self.supabase_key:
+            raise RuntimeError("Supabase configuration is missing")
+
         self.storage_service = StorageService()
+        self._events_url = f"{self.supabase_url}/rest/v1/events"
+        # Anon-key headers for reads; the variants below add PostgREST preferences
+        self._read_headers = {
+            "apikey": self.supabase_key,
+            "Authorization": f"Bearer {self.supabase_key}",
+        }
+        self._return_headers = {**self._read_headers, "Prefer": "return=representation"}
+        # Ask PostgREST for a single JSON object; it answers 406 when no row matches
+        self._object_headers = {**self._read_headers, "Accept": "application/vnd.pgrst.object+json"}
+        self._write_object_headers = {
+            **self._return_headers,
+            **self._object_headers,
+            "Content-Type": "application/json",
+        }
+        # event_id -> (ETag, parsed event), least recently used first
+        self._etag_cache: "OrderedDict[int, Tuple[str, EventResponse]]" = OrderedDict()
 
     async def create_event(self, event_data: EventCreate) -> EventResponse:
         """Create a new event."""
-        if not self.supabase_url or not self.supabase_key:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Supabase configuration is missing"
+        try:
+            # Prepare data for Supabase
+            event_payload = _build_create_payload(event_data)
+
+            response = await get_http_client().post(
+                self._events_url,
+                headers=self._write_object_headers,  # Return the created record
+                content=orjson.dumps(event_payload),
             )
 
-        async with httpx.AsyncClient() as client:
-            try:
-                # Prepare data for Supabase
-                event_payload = {
-                    "name": event_data.name,
-                    "description": event_data.description,
-                    "date": event_data.date.isoformat(),
-                    "photo_url": event_data.photo_url,
-                    "meeting_link": event_data.meeting_link,
-                }
-
-                response = await client.post(
-                    f"{self.supabase_url}/rest/v1/events",
-                    headers={
-                        "apikey": self.supabase_key,
-                        "Authorization": f"Bearer {self.supabase_key}",
-                        "Content-Type": "application/json",
-                        "Prefer": "return=representation",  # Return the created record
-                    },
-                    json=event_payload,
-                )
-
-                if response.status_code not in [200, 201]:
-                    error_data = response.json() if response.content else {}
-                    error_msg = error_data.get("message", "Failed to create event")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Error creating event: {error_msg}"
-                    )
-
-                data = response.json()
-                # PostgREST returns an array, get first item
-                event = data[0] if isinstance(data, list) else data
-                return EventResponse(**event)
-
-            except HTTPException:
-                raise
-            except Exception as e:
+            if response.status_code not in [200, 201]:
+                error_data = read_json(response)
+                error_msg = error_data.get("message", "Failed to create event")
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Error creating event: {str(e)}"
+                    status_code=response.status_code,
+                    detail=f"Error creating event: {error_msg}"
                 )
 
-    async def get_event(self, event_id: int) -> EventResponse:
-        """Get an event by ID."""
-        if not self.supabase_url or not self.supabase_key:
+            return _EVENT_ADAPTER.validate_json(response.content)
+
+        except HTTPException:
+            raise
+        except Exception as e:
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Supabase configuration is missing"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error creating event: {str(e)}"
             )
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.supabase_url}/rest/v1/events",
-                    headers={
-                        "apikey": self.supabase_key,
-                        "Authorization": f"Bearer {self.supabase_key}",
-                    },
-                    params={
-                        "id": f"eq.{event_id}",
-                        "select": "*",
-                    },
-                )
-
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail="Failed to fetch event"
-                    )
+    async def get_event(self, event_id: int) -> EventResponse:
+        """Get an event by ID."""
+        try:
+            # Revalidate a cached copy so Supabase can answer 304 without a body
+            cached = self._etag_cache.get(event_id)
+            headers = self._object_headers
+            if cached is not None:
+                headers = {**headers, "If-None-Match": cached[0]}
+
+            response = await get_http_client().get(
+                self._events_url,
+                headers=headers,
+                params={
+                    "id": f"eq.{event_id}",
+                    "select": "*",
+                },
+            )
 
-                data = response.json()
-                if not data or len(data) == 0:
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail="Event not found"
-                    )
+            if response.status_code == status.HTTP_304_NOT_MODIFIED and cached is not None:
+                if event_id in self._etag_cache:
+                    self._etag_cache.move_to_end(event_id)
+                return cached[1]
 
-                return EventResponse(**data[0])
+            self._etag_cache.pop(event_id, None)
 
-            except HTTPException:
-                raise
-            except Exception as e:
+            if response.status_code == status.HTTP_406_NOT_ACCEPTABLE:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="Event not found"
                 )
 
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail="Failed to fetch event"
+                )
+
+            event = _EVENT_ADAPTER.validate_json(response.content)
+
+            etag = response.headers.get("ETag")
+            if etag:
+                self._etag_cache[event_id] = (etag, event)
+                if len(self._etag_cache) > self.ETAG_CACHE_SIZE:
+                    self._etag_cache.popitem(last=False)
+
+            return event
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Event not found"
+            )
+
     async def get_all_events(
         self,
         skip: int = 0,
@@ -117,51 +173,41 @@ class EventService:
         upcoming_only: bool = False
     ) -> List[EventResponse]:
         """Get all events with optional filtering."""
-        if not self.supabase_url or not self.supabase_key:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Supabase configuration is missing"
+        try:
+            params = {
+                "select": "*",
+                "order": "date.asc",
+                "limit": limit,
+                "offset": skip,
+            }
+
+            # Filter for upcoming events only; truncate to the minute so
+            # identical requests within that window share a cacheable URL
+            if upcoming_only:
+                now = datetime.now().replace(second=0, microsecond=0).isoformat()
+                params["date"] = f"gte.{now}"
+
+            response = await get_http_client().get(
+                self._events_url,
+                headers=self._read_headers,
+                params=params,
             )
 
-        async with httpx.AsyncClient() as client:
-            try:
-                params = {
-                    "select": "*",
-                    "order": "date.asc",
-                    "limit": limit,
-                    "offset": skip,
-                }
-
-                # Filter for upcoming events only
-                if upcoming_only:
-                    now = datetime.now().isoformat()
-                    params["date"] = f"gte.{now}"
-
-                response = await client.get(
-                    f"{self.supabase_url}/rest/v1/events",
-                    headers={
-                        "apikey": self.supabase_key,
-                        "Authorization": f"Bearer {self.supabase_key}",
-                    },
-                    params=params,
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail="Failed to fetch events"
                 )
 
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail="Failed to fetch events"
-                    )
+            return _EVENT_LIST_ADAPTER.validate_json(response.content)
 
-                data = response.json()
-                return [EventResponse(**event) for event in data]
-
-            except HTTPException:
-                raise
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Error fetching events: {str(e)}"
-                )
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error fetching events: {str(e)}"
+            )
 
     async def update_event(
         self,
@@ -169,147 +215,102 @@ class EventService:
         event_data: EventUpdate
     ) -> EventResponse:
         """Update an event."""
-        if not self.supabase_url or not self.supabase_key:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Supabase configuration is missing"
+        try:
+            # Prepare update payload (only include fields the client sent)
+            update_payload = _build_update_payload(event_data)
+
+            if not update_payload:
+                # No fields to update, return existing event
+                return await self.get_event(event_id)
+
+            self._etag_cache.pop(event_id, None)
+
+            # Update event; a 406 means no row matched
+            response = await get_http_client().patch(
+                self._events_url,
+                headers=self._write_object_headers,
+                params={
+                    "id": f"eq.{event_id}",
+                },
+                content=orjson.dumps(update_payload),
             )
 
-        async with httpx.AsyncClient() as client:
-            try:
-                # Check if event exists first
-                check_response = await client.get(
-                    f"{self.supabase_url}/rest/v1/events",
-                    headers={
-                        "apikey": self.supabase_key,
-                        "Authorization": f"Bearer {self.supabase_key}",
-                    },
-                    params={
-                        "id": f"eq.{event_id}",
-                        "select": "id",
-                    },
-                )
-
-                if check_response.status_code != 200 or not check_response.json():
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail="Event not found"
-                    )
-
-                # Prepare update payload (only include provided fields)
-                update_payload = {}
-                if event_data.name is not None:
-                    update_payload["name"] = event_data.name
-                if event_data.description is not None:
-                    update_payload["description"] = event_data.description
-                if event_data.date is not None:
-                    update_payload["date"] = event_data.date.isoformat()
-                if event_data.photo_url is not None:
-                    update_payload["photo_url"] = event_data.photo_url
-                if event_data.meeting_link is not None:
-                    update_payload["meeting_link"] = event_data.meeting_link
-
-                if not update_payload:
-                    # No fields to update, return existing event
-                    return await self.get_event(event_id)
-
-                # Update event
-                response = await client.patch(
-                    f"{self.supabase_url}/rest/v1/events",
-                    headers={
-                        "apikey": self.supabase_key,
-                        "Authorization": f"Bearer {self.supabase_key}",
-                        "Content-Type": "application/json",
-                        "Prefer": "return=representation",
-                    },
-                    params={
-                        "id": f"eq.{event_id}",
-                    },
-                    json=update_payload,
+            if response.status_code == status.HTTP_406_NOT_ACCEPTABLE:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Event not found"
                 )
 
-                if response.status_code != 200:
-                    error_data = response.json() if response.content else {}
-                    error_msg = error_data.get("message", "Failed to update event")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Error updating event: {error_msg}"
-                    )
-
-                data = response.json()
-                event = data[0] if isinstance(data, list) else data
-                return EventResponse(**event)
-
-            except HTTPException:
-                raise
-            except Exception as e:
+            if response.status_code != 200:
+                error_data = read_json(response)
+                error_msg = error_data.get("message", "Failed to update event")
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Error updating event: {str(e)}"
+                    status_code=response.status_code,
+                    detail=f"Error updating event: {error_msg}"
                 )
 
+            return _EVENT_ADAPTER.validate_json(response.content)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error updating event: {str(e)}"
+            )
+
     async def delete_event(self, event_id: int) -> dict:
         """Delete an event."""
-        if not self.supabase_url or not self.supabase_key:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Supabase configuration is missing"
+        try:
+            self._etag_cache.pop(event_id, None)
+
+            # Delete event and get the deleted row back in the same round trip
+            response = await get_http_client().delete(
+                self._events_url,
+                headers=self._return_headers,
+                params={
+                    "id": f"eq.{event_id}",
+                    "select": "photo_url",
+                },
             )
 
-        async with httpx.AsyncClient() as client:
-            try:
-                # Get event first to check if it exists and get photo_url
-                get_response = await client.get(
-                    f"{self.supabase_url}/rest/v1/events",
-                    headers={
-                        "apikey": self.supabase_key,
-                        "Authorization": f"Bearer {self.supabase_key}",
-                    },
-                    params={
-                        "id": f"eq.{event_id}",
-                        "select": "photo_url",
-                    },
+            if response.status_code not in [200, 204]:
+                error_data = read_json(response)
+                error_msg = error_data.get("message", "Failed to delete event")
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"Error deleting event: {error_msg}"
                 )
 
-                if get_response.status_code != 200 or not get_response.json():
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail="Event not found"
-                    )
-
-                event_data = get_response.json()[0]
-                photo_url = event_data.get("photo_url")
-
-                # Delete photo from storage if it exists
-                if photo_url:
-                    await self.storage_service.delete_file(photo_url)
-
-                # Delete event
-                response = await client.delete(
-                    f"{self.supabase_url}/rest/v1/events",
-                    headers={
-                        "apikey": self.supabase_key,
-                        "Authorization": f"Bearer {self.supabase_key}",
-                    },
-                    params={
-                        "id": f"eq.{event_id}",
-                    },
+            data = read_json(response) or []
+            if not data:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Event not found"
                 )
 
-                if response.status_code not in [200, 204]:
-                    error_data = response.json() if response.content else {}
-                    error_msg = error_data.get("message", "Failed to delete event")
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=f"Error deleting event: {error_msg}"
-                    )
+            photo_url = data[0].get("photo_url")
 
-                return {"message": "Event deleted successfully", "event_id": event_id}
+            # Delete photo from storage if it exists, without holding the response
+            if photo_url:
+                run_in_background(self._delete_photo(photo_url))
 
-            except HTTPException:
-                raise
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Error deleting event: {str(e)}"
-                )
+            return {"message": "Event deleted successfully", "event_id": event_id}
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error deleting event: {str(e)}"
+            )
+
+    async def _delete_photo(self, photo_url: str) -> None:
+        """Remove an event photo from storage, logging instead of raising on failure."""
+        try:
+            deleted = await self.storage_service.delete_file(photo_url)
+        except Exception:
+            logger.exception("Error deleting event photo %s", photo_url)
+            return
+        if not deleted:
+            logger.warning("Failed to delete event photo %s", photo_url)
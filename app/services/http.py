@@ -0,0 +1,68 @@
+from typing import Any, Coroutine, Optional, Set, TYPE_CHECKING
+import asyncio
+import orjson
+
+if TYPE_CHECKING:
+    import httpx
+
+
+# Process-wide client shared by all services so Supabase connections are reused
+_client: Optional["httpx.AsyncClient"] = None
+
+# Strong references to background work so it is not garbage collected and
+# shutdown can wait for it before the client is closed
+_background_tasks: Set["asyncio.Task"] = set()
+
+
+def get_http_client() -> "httpx.AsyncClient":
+    """Return the shared HTTP client, creating it on first use.
+
+    Services call this for every request instead of keeping the client, so a
+    client recreated after a shutdown is picked up.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        # Imported here so httpx is only loaded once a client is actually needed
+        import httpx
+
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=300,
+            ),
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client and release its connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def run_in_background(coro: Coroutine[Any, Any, Any]) -> "asyncio.Task":
+    """Run a coroutine as a tracked background task."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def drain_background_tasks(timeout: float) -> None:
+    """Wait for background tasks to finish, cancelling any still running after timeout."""
+    if not _background_tasks:
+        return
+    _, pending = await asyncio.wait(set(_background_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+def read_json(response: "httpx.Response") -> Any:
+    """Decode a response body with orjson, returning {} for an empty body."""
+    return orjson.loads(response.content) if response.content else {}
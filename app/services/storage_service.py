@@ -1,32 +1,177 @@
-from typing import Optional, List
+from typing import Awaitable, Optional, List, Tuple
+from collections import OrderedDict, defaultdict
+import asyncio
+import logging
+import random
+import tempfile
 from fastapi import HTTPException, status, UploadFile
-import httpx
-from app.config import settings
+from app.config import get_settings
+from app.services.http import get_http_client, read_json, run_in_background
+import orjson
 import uuid
 from pathlib import Path
 import mimetypes
 
 
+logger = logging.getLogger(__name__)
+
+# Load the MIME type database at import instead of on the first upload
+mimetypes.init()
+
+# Size of each chunk read from an upload while streaming it to Supabase
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Bytes of a background upload kept in memory before it spills to disk
+_SPOOL_MEMORY_SIZE = 1024 * 1024
+
+# Number of leading bytes inspected to detect the real image type
+_SNIFF_SIZE = 512
+
+# Leading byte signatures of the supported image formats
+_MAGIC = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def _looks_like_svg(head: bytes) -> bool:
+    """Check whether text starts with an <svg> root, after any XML prolog."""
+    text = head[3:] if head.startswith(b"\xef\xbb\xbf") else head
+    while True:
+        text = text.lstrip()
+        if text.startswith(b"<?"):
+            end = text.find(b"?>")
+            skip = 2
+        elif text.startswith(b"<!--"):
+            end = text.find(b"-->")
+            skip = 3
+        elif text.startswith(b"<!"):
+            # A DOCTYPE may carry an internal subset in [...] containing '>'
+            end = text.find(b">")
+            bracket = text.find(b"[")
+            if 0 <= bracket < end:
+                end = text.find(b">", text.find(b"]", bracket))
+            skip = 1
+        else:
+            # The tag name must end here, so <svgfoo> does not count
+            return text[:4].lower() == b"<svg" and text[4:5] in (b"", b">", b"/", b" ", b"\t", b"\r", b"\n")
+        
+        # The prolog runs past the sniff window
+        if end < 0:
+            return False
+        text = text[end + skip:]
+
+
+def _sniff_image_type(head: bytes) -> Optional[str]:
+    """Detect an image MIME type from the first bytes of a file."""
+    for signature, content_type in _MAGIC:
+        if head.startswith(signature):
+            return content_type
+    
+    # WebP: "RIFF" <4-byte size> "WEBP"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    
+    # SVG is text, optionally preceded by a BOM, XML declaration, comments or DOCTYPE
+    if _looks_like_svg(head):
+        return "image/svg+xml"
+    
+    return None
+
+
+def _file_too_large(max_size: int, file_size: Optional[int] = None) -> HTTPException:
+    """Build the error raised when an upload exceeds max_size."""
+    if file_size is None:
+        detail = f"File size exceeds maximum allowed size ({max_size / 1024 / 1024:.2f}MB)"
+    else:
+        detail = f"File size ({file_size / 1024 / 1024:.2f}MB) exceeds maximum allowed size ({max_size / 1024 / 1024:.2f}MB)"
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+def _split_public_url(file_url: str) -> Optional[Tuple[str, str]]:
+    """Split a public Storage URL into (bucket_name, file_path), or None if it is not one."""
+    # URL format: https://xxx.supabase.co/storage/v1/object/public/bucket/path/to/file
+    _, sep, tail = file_url.partition("/storage/v1/object/public/")
+    if not sep:
+        return None
+    bucket_name, _, file_path = tail.partition("/")
+    if not bucket_name or not file_path:
+        return None
+    return bucket_name, file_path
+
+
+async def _iter_upload(file: UploadFile, max_size: int):
+    """Yield an upload in chunks, enforcing max_size as bytes are read."""
+    total = 0
+    while chunk := await file.read(_UPLOAD_CHUNK_SIZE):
+        total += len(chunk)
+        if total > max_size:
+            raise _file_too_large(max_size)
+        yield chunk
+
+
+async def _spool_upload(file: UploadFile, max_size: int) -> UploadFile:
+    """Copy an upload into a temporary file that outlives the request."""
+    # Only small uploads stay in memory, so pending jobs cannot pile up RAM
+    spooled = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MEMORY_SIZE)
+    size = 0
+    try:
+        async for chunk in _iter_upload(file, max_size):
+            spooled.write(chunk)
+            size += len(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return UploadFile(spooled, size=size, filename=file.filename, headers=file.headers)
+
+
 class StorageService:
     """Service for handling file uploads to Supabase Storage."""
     
     # Allowed image MIME types
-    ALLOWED_IMAGE_TYPES = {
+    ALLOWED_IMAGE_TYPES = frozenset({
         "image/jpeg",
         "image/jpg",
         "image/png",
         "image/gif",
         "image/webp",
         "image/svg+xml"
-    }
+    })
+    _ALLOWED_IMAGE_TYPES_STR = ", ".join(sorted(ALLOWED_IMAGE_TYPES))
+    
+    # Extensions for the allowed image types, resolved once
+    _EXT_CACHE = {ct: mimetypes.guess_extension(ct) or "" for ct in ALLOWED_IMAGE_TYPES}
     
     # Maximum file size in bytes (10MB default)
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
     
+    # Maximum number of paths removed by a single batch delete request
+    DELETE_BATCH_SIZE = 1000
+    
+    # Upload attempts made when Supabase answers with a transient server error
+    UPLOAD_ATTEMPTS = 3
+    
+    # Server errors worth retrying; 408 and other 4xx responses are final
+    RETRYABLE_STATUS_CODES = frozenset({500, 502, 503, 504})
+    
+    # Maximum number of background upload jobs whose status is kept for polling
+    UPLOAD_JOB_CACHE_SIZE = 1024
+    
     def __init__(self):
+        settings = get_settings()
         self.supabase_url = settings.supabase_url
         self.supabase_key = settings.supabase_key
         self.service_role_key = settings.supabase_service_role_key
+        # Service role headers bypass RLS; built once
+        self._service_headers = {
+            "apikey": self.service_role_key,
+            "Authorization": f"Bearer {self.service_role_key}",
+        }
+        # job_id -> job status, oldest first
+        self._upload_jobs: "OrderedDict[str, dict]" = OrderedDict()
     
     async def upload_image(
         self,
@@ -34,7 +179,7 @@ class StorageService:
         bucket_name: str,
         folder: Optional[str] = None,
         max_size: Optional[int] = None,
-        allowed_types: Optional[set] = None
+        allowed_types: Optional[frozenset] = None
     ) -> str:
         """
         Upload an image file to Supabase Storage.
@@ -44,7 +189,7 @@ class StorageService:
             bucket_name: Name of the Supabase Storage bucket
             folder: Optional folder path within the bucket (e.g., "events", "users")
             max_size: Maximum file size in bytes (default: 10MB)
-            allowed_types: Set of allowed MIME types (default: common image types)
+            allowed_types: Frozenset of allowed MIME types (default: common image types)
         
         Returns:
             Public URL of the uploaded file
@@ -61,117 +206,175 @@ class StorageService:
         
         # Set defaults
         max_size = max_size or self.MAX_FILE_SIZE
-        allowed_types = allowed_types or self.ALLOWED_IMAGE_TYPES
+        if allowed_types is None:
+            allowed_types = self.ALLOWED_IMAGE_TYPES
         
-        # Validate file type
-        if not file.content_type:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="File content type is required"
-            )
+        content_type = await self._check_image_type(file, allowed_types)
+        
+        return await self._upload(file, bucket_name, folder, max_size, content_type)
+    
+    async def upload_file(
+        self,
+        file: UploadFile,
+        bucket_name: str,
+        folder: Optional[str] = None,
+        max_size: Optional[int] = None
+    ) -> str:
+        """
+        Upload any file type to Supabase Storage.
         
-        if file.content_type not in allowed_types:
+        Args:
+            file: The file to upload
+            bucket_name: Name of the Supabase Storage bucket
+            folder: Optional folder path within the bucket
+            max_size: Maximum file size in bytes (default: 10MB)
+        
+        Returns:
+            Public URL of the uploaded file
+        """
+        max_size = max_size or self.MAX_FILE_SIZE
+        
+        if not self.supabase_url or not self.service_role_key:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"File type '{file.content_type}' is not allowed. Allowed types: {', '.join(allowed_types)}"
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Supabase configuration is missing. Service role key is required for file uploads."
             )
         
-        try:
-            # Read file content
-            file_content = await file.read()
-            
-            # Validate file size
-            file_size = len(file_content)
-            if file_size > max_size:
+        return await self._upload(
+            file, bucket_name, folder, max_size, file.content_type or "application/octet-stream"
+        )
+    
+    async def _check_image_type(self, file: UploadFile, allowed_types: frozenset) -> str:
+        """Validate an image upload by its leading bytes and return its real content type."""
+        # Detect the real type from the file header instead of trusting the
+        # client-supplied content type, so bad uploads are rejected early
+        head = await file.read(_SNIFF_SIZE)
+        await file.seek(0)
+        content_type = _sniff_image_type(head)
+        
+        if content_type is None:
+            if file.content_type in self.ALLOWED_IMAGE_TYPES:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"File size ({file_size / 1024 / 1024:.2f}MB) exceeds maximum allowed size ({max_size / 1024 / 1024:.2f}MB)"
+                    detail=f"File content does not match declared type '{file.content_type}'"
                 )
-            
-            # Generate unique filename
-            file_extension = self._get_file_extension(file.filename, file.content_type)
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            
-            # Build file path
-            if folder:
-                file_path = f"{folder}/{unique_filename}"
+            content_type = file.content_type
+        
+        # Validate file type
+        if not content_type:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="File content type is required"
+            )
+        
+        if content_type not in allowed_types:
+            if allowed_types is self.ALLOWED_IMAGE_TYPES:
+                allowed_str = self._ALLOWED_IMAGE_TYPES_STR
             else:
-                file_path = unique_filename
-            
-            # Upload to Supabase Storage using service role key to bypass RLS
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                upload_response = await client.post(
-                    f"{self.supabase_url}/storage/v1/object/{bucket_name}/{file_path}",
-                    headers={
-                        "apikey": self.service_role_key,
-                        "Authorization": f"Bearer {self.service_role_key}",
-                        "Content-Type": file.content_type,
-                    },
-                    content=file_content,
-                )
-                
-                if upload_response.status_code not in [200, 201]:
-                    error_data = upload_response.json() if upload_response.content else {}
-                    error_msg = error_data.get("message", "Failed to upload file")
-                    raise HTTPException(
-                        status_code=upload_response.status_code,
-                        detail=f"Error uploading file: {error_msg}"
-                    )
-                
-                # Return public URL
-                public_url = f"{self.supabase_url}/storage/v1/object/public/{bucket_name}/{file_path}"
-                return public_url
-                
-        except HTTPException:
-            raise
-        except Exception as e:
+                allowed_str = ", ".join(sorted(allowed_types))
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Error uploading file: {str(e)}"
+                detail=f"File type '{content_type}' is not allowed. Allowed types: {allowed_str}"
             )
+        
+        return content_type
     
-    async def upload_file(
+    async def submit_upload(
         self,
         file: UploadFile,
         bucket_name: str,
         folder: Optional[str] = None,
-        max_size: Optional[int] = None
-    ) -> str:
+        max_size: Optional[int] = None,
+        image_only: bool = False
+    ) -> Tuple[str, str]:
         """
-        Upload any file type to Supabase Storage.
+        Accept an upload and send it to Supabase Storage in the background.
+        
+        The file is copied out of the request first, so the caller can respond
+        before the Supabase round trip finishes.
         
         Args:
             file: The file to upload
             bucket_name: Name of the Supabase Storage bucket
             folder: Optional folder path within the bucket
             max_size: Maximum file size in bytes (default: 10MB)
+            image_only: Validate the file as an image, as upload_image does
         
         Returns:
-            Public URL of the uploaded file
-        """
-        max_size = max_size or self.MAX_FILE_SIZE
+            Job id to pass to get_upload_job, and the content type being uploaded
         
+        Raises:
+            HTTPException: If validation fails; nothing is queued in that case
+        """
         if not self.supabase_url or not self.service_role_key:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Supabase configuration is missing. Service role key is required for file uploads."
             )
         
+        max_size = max_size or self.MAX_FILE_SIZE
+        
+        # Validate before spooling so bad files are rejected with the request
+        if image_only:
+            content_type = await self._check_image_type(file, self.ALLOWED_IMAGE_TYPES)
+        else:
+            content_type = file.content_type or "application/octet-stream"
+        
+        spooled = await _spool_upload(file, max_size)
+        
+        job_id = uuid.uuid4().hex
+        self._upload_jobs[job_id] = {"job_id": job_id, "status": "accepted"}
+        if len(self._upload_jobs) > self.UPLOAD_JOB_CACHE_SIZE:
+            self._upload_jobs.popitem(last=False)
+        
+        run_in_background(
+            self._run_upload_job(
+                job_id, spooled, self._upload(spooled, bucket_name, folder, max_size, content_type)
+            )
+        )
+        return job_id, content_type
+    
+    def get_upload_job(self, job_id: str) -> Optional[dict]:
+        """Return the status of a background upload, or None if it is unknown."""
+        return self._upload_jobs.get(job_id)
+    
+    async def _run_upload_job(self, job_id: str, file: UploadFile, upload: Awaitable[str]) -> None:
+        """Finish a background upload and record its outcome."""
         try:
-            # Read file content
-            file_content = await file.read()
-            
-            # Validate file size
-            file_size = len(file_content)
-            if file_size > max_size:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"File size ({file_size / 1024 / 1024:.2f}MB) exceeds maximum allowed size ({max_size / 1024 / 1024:.2f}MB)"
-                )
+            url = await upload
+            result = {"job_id": job_id, "status": "completed", "url": url}
+        except HTTPException as e:
+            result = {"job_id": job_id, "status": "failed", "status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.exception("Background upload %s failed", job_id)
+            result = {"job_id": job_id, "status": "failed", "status_code": 500, "detail": str(e)}
+        finally:
+            await file.close()
+        
+        # Only record the outcome if the job has not been evicted meanwhile
+        if job_id in self._upload_jobs:
+            self._upload_jobs[job_id] = result
+    
+    async def _upload(
+        self,
+        file: UploadFile,
+        bucket_name: str,
+        folder: Optional[str],
+        max_size: int,
+        content_type: str
+    ) -> str:
+        """Stream a validated upload to Supabase Storage and return its public URL."""
+        try:
+            # Reject early when the size is already known, otherwise the
+            # limit is enforced while streaming
+            file_size = getattr(file, "size", None)
+            if file_size is not None and file_size > max_size:
+                raise _file_too_large(max_size, file_size)
             
-            # Generate unique filename
-            file_extension = self._get_file_extension(file.filename, file.content_type)
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
+            # Generate unique filename; names are never shared between uploads,
+            # so deleting one file cannot remove another upload's content
+            file_extension = self._get_file_extension(file.filename, content_type)
+            unique_filename = f"{uuid.uuid4().hex}{file_extension}"
             
             # Build file path
             if folder:
@@ -179,30 +382,41 @@ class StorageService:
             else:
                 file_path = unique_filename
             
-            # Upload to Supabase Storage using service role key to bypass RLS
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                upload_response = await client.post(
+            headers = {**self._service_headers, "Content-Type": content_type}
+            # With a known size send Content-Length, otherwise httpx falls
+            # back to chunked transfer encoding
+            if file_size is not None:
+                headers["Content-Length"] = str(file_size)
+            
+            # Upload to Supabase Storage using service role key to bypass RLS.
+            # The body is streamed instead of buffering the whole file in memory,
+            # and replayed from the start of the file on a retry.
+            for attempt in range(self.UPLOAD_ATTEMPTS):
+                if attempt:
+                    await asyncio.sleep(0.2 * 2 ** (attempt - 1) + random.random() * 0.1)
+                    await file.seek(0)
+                
+                upload_response = await get_http_client().post(
                     f"{self.supabase_url}/storage/v1/object/{bucket_name}/{file_path}",
-                    headers={
-                        "apikey": self.service_role_key,
-                        "Authorization": f"Bearer {self.service_role_key}",
-                        "Content-Type": file.content_type or "application/octet-stream",
-                    },
-                    content=file_content,
+                    headers=headers,
+                    content=_iter_upload(file, max_size),
                 )
                 
-                if upload_response.status_code not in [200, 201]:
-                    error_data = upload_response.json() if upload_response.content else {}
-                    error_msg = error_data.get("message", "Failed to upload file")
-                    raise HTTPException(
-                        status_code=upload_response.status_code,
-                        detail=f"Error uploading file: {error_msg}"
-                    )
-                
-                # Return public URL
-                public_url = f"{self.supabase_url}/storage/v1/object/public/{bucket_name}/{file_path}"
-                return public_url
-                
+                if upload_response.status_code not in self.RETRYABLE_STATUS_CODES:
+                    break
+            
+            if upload_response.status_code not in [200, 201]:
+                error_data = read_json(upload_response)
+                error_msg = error_data.get("message", "Failed to upload file")
+                raise HTTPException(
+                    status_code=upload_response.status_code,
+                    detail=f"Error uploading file: {error_msg}"
+                )
+            
+            # Return public URL
+            public_url = f"{self.supabase_url}/storage/v1/object/public/{bucket_name}/{file_path}"
+            return public_url
+            
         except HTTPException:
             raise
         except Exception as e:
@@ -226,29 +440,19 @@ class StorageService:
         
         try:
             # Extract bucket and file path from URL
-            # URL format: https://xxx.supabase.co/storage/v1/object/public/bucket/path/to/file
-            if "/storage/v1/object/public/" not in file_url:
+            parts = _split_public_url(file_url)
+            if parts is None:
                 return False
             
-            path_part = file_url.split("/storage/v1/object/public/")[1]
-            parts = path_part.split("/", 1)
+            bucket_name, file_path = parts
             
-            if len(parts) != 2:
-                return False
+            delete_response = await get_http_client().delete(
+                f"{self.supabase_url}/storage/v1/object/{bucket_name}/{file_path}",
+                headers=self._service_headers,
+            )
             
-            bucket_name, file_path = parts
+            return delete_response.status_code in [200, 204]
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                delete_response = await client.delete(
-                    f"{self.supabase_url}/storage/v1/object/{bucket_name}/{file_path}",
-                    headers={
-                        "apikey": self.service_role_key,
-                        "Authorization": f"Bearer {self.service_role_key}",
-                    },
-                )
-                
-                return delete_response.status_code in [200, 204]
-                
         except Exception:
             return False
     
@@ -264,15 +468,55 @@ class StorageService:
         """
         results = {"success": 0, "failed": []}
         
+        # Group paths by bucket so each bucket needs one request per batch
+        paths_by_bucket = defaultdict(list)
         for url in file_urls:
-            success = await self.delete_file(url)
-            if success:
-                results["success"] += 1
-            else:
+            parts = _split_public_url(url)
+            if parts is None:
                 results["failed"].append(url)
+                continue
+            bucket_name, file_path = parts
+            paths_by_bucket[bucket_name].append((file_path, url))
+        
+        if not self.supabase_url or not self.service_role_key:
+            results["failed"].extend(url for entries in paths_by_bucket.values() for _, url in entries)
+            return results
+        
+        async def delete_batch(bucket_name: str, entries: list) -> None:
+            deleted = await self._delete_paths(bucket_name, [path for path, _ in entries])
+            for path, url in entries:
+                if path in deleted:
+                    results["success"] += 1
+                else:
+                    results["failed"].append(url)
+        
+        # Batches are independent, so run them concurrently
+        await asyncio.gather(*(
+            delete_batch(bucket_name, entries[i:i + self.DELETE_BATCH_SIZE])
+            for bucket_name, entries in paths_by_bucket.items()
+            for i in range(0, len(entries), self.DELETE_BATCH_SIZE)
+        ))
         
         return results
     
+    async def _delete_paths(self, bucket_name: str, file_paths: List[str]) -> set:
+        """Remove several objects from one bucket and return the paths that were deleted."""
+        try:
+            delete_response = await get_http_client().request(
+                "DELETE",
+                f"{self.supabase_url}/storage/v1/object/{bucket_name}",
+                headers={**self._service_headers, "Content-Type": "application/json"},
+                content=orjson.dumps({"prefixes": file_paths}),
+            )
+            
+            if delete_response.status_code != 200:
+                return set()
+            
+            return {obj.get("name") for obj in read_json(delete_response)}
+            
+        except Exception:
+            return set()
+    
     def _get_file_extension(self, filename: Optional[str], content_type: Optional[str]) -> str:
         """Get file extension from filename or content type."""
         # Try to get extension from filename
@@ -283,7 +527,10 @@ class StorageService:
         
         # Fall back to content type
         if content_type:
-            extension = mimetypes.guess_extension(content_type)
+            if content_type in self._EXT_CACHE:
+                extension = self._EXT_CACHE[content_type]
+            else:
+                extension = mimetypes.guess_extension(content_type)
             if extension:
                 return extension
         
@@ -1,132 +1,185 @@
-from typing import Optional
-import httpx
-import json
+from typing import Optional, Tuple
+from collections import OrderedDict
+from functools import lru_cache
+import logging
+import time
+import orjson
 from app.models.user import UserCreate, UserUpdate, UserResponse, UserLogin
-from app.config import settings
+from app.config import get_settings
+from app.services.http import get_http_client, read_json
 from fastapi import HTTPException, status
 from datetime import datetime
 
 
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=4096)
+def _parse_ts(value: str) -> datetime:
+    """Parse a Supabase timestamp, memoized since the same values recur per user."""
+    return datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+
+
+def _build_user_response(
+    user: dict,
+    full_name: Optional[str] = None,
+    phone: Optional[str] = None
+) -> UserResponse:
+    """Build a UserResponse from a Supabase Auth user object.
+
+    Supabase produced this data, so pydantic validation is skipped; only the
+    required fields are checked. Callers turn the ValueError into their usual
+    error response, as they did for a failed validation.
+    """
+    if not user.get("id") or not user.get("email"):
+        raise ValueError("Supabase user is missing id or email")
+    user_metadata = user.get("user_metadata") or {}
+    created_at = user.get("created_at")
+    return UserResponse.model_construct(
+        id=user.get("id"),
+        email=user.get("email"),
+        full_name=user_metadata.get("full_name") or full_name,
+        phone=user_metadata.get("phone") or phone,
+        created_at=_parse_ts(created_at) if created_at else None
+    )
+
+
 class UserService:
+    # Admin user lookups are cached briefly to absorb repeated reads
+    USER_CACHE_SIZE = 10_000
+    USER_CACHE_TTL = 30  # seconds
+
     def __init__(self):
+        settings = get_settings()
         self.supabase_url = settings.supabase_url
         self.supabase_key = settings.supabase_key
         self.service_role_key = settings.supabase_service_role_key
+        # Anon key for signup and login, service role key for admin calls
+        self._anon_headers = {
+            "apikey": self.supabase_key,
+            "Content-Type": "application/json",
+        }
+        self._admin_headers = {
+            "apikey": self.service_role_key,
+            "Authorization": f"Bearer {self.service_role_key}",
+        }
+        self._admin_write_headers = {**self._admin_headers, "Content-Type": "application/json"}
+        # user_id -> (expiry time, user), least recently used first
+        self._user_cache: "OrderedDict[str, Tuple[float, UserResponse]]" = OrderedDict()
+        # Bumped by every write so lookups already in flight do not cache stale users
+        self._cache_generation = 0
+
+    def _cache_user(self, user_id: str, user: UserResponse) -> None:
+        """Store a user in the lookup cache, evicting the least recently used entry."""
+        self._user_cache[user_id] = (time.monotonic() + self.USER_CACHE_TTL, user)
+        self._user_cache.move_to_end(user_id)
+        if len(self._user_cache) > self.USER_CACHE_SIZE:
+            self._user_cache.popitem(last=False)
+
+    def _invalidate_user(self, user_id: str) -> None:
+        """Drop a cached user and discard any lookup that started before now."""
+        self._cache_generation += 1
+        self._user_cache.pop(user_id, None)
 
     async def create_user(self, user_data: UserCreate) -> UserResponse:
         """Create a new user in Supabase Auth."""
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{self.supabase_url}/auth/v1/signup",
-                    headers={
-                        "apikey": self.supabase_key,
-                        "Content-Type": "application/json",
-                    },
-                    json={
-                        "email": user_data.email,
-                        "password": user_data.password,
-                        "data": {
-                            "full_name": user_data.full_name,
-                            "phone": user_data.phone
-                        }
-                    },
-                )
-
-                if response.status_code != 200:
-                    error_data = response.json() if response.content else {}
-                    error_msg = error_data.get("msg", "Failed to create user")
-                    
-                    if "already registered" in error_msg.lower() or "already exists" in error_msg.lower():
-                        raise HTTPException(
-                            status_code=status.HTTP_409_CONFLICT,
-                            detail="User with this email already exists"
-                        )
-                    
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=error_msg
-                    )
+        try:
+            response = await get_http_client().post(
+                f"{self.supabase_url}/auth/v1/signup",
+                headers=self._anon_headers,
+                content=orjson.dumps({
+                    "email": user_data.email,
+                    "password": user_data.password,
+                    "data": {
+                        "full_name": user_data.full_name,
+                        "phone": user_data.phone
+                    }
+                }),
+            )
 
-                data = response.json()
-                print(json.dumps(data, indent=4))
+            if response.status_code != 200:
+                error_data = read_json(response)
+                error_msg = error_data.get("msg", "Failed to create user")
                 
-                if not data:
+                if "already registered" in error_msg.lower() or "already exists" in error_msg.lower():
                     raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Failed to create user"
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail="User with this email already exists"
                     )
-
-                user = data.get("user_metadata", {})
                 
-                return UserResponse(
-                    id=user.get("sub"),
-                    email=user.get("email"),
-                    full_name=user.get("full_name") or data.full_name,
-                    phone=user.get("phone") or data.phone,
-                    created_at=datetime.fromisoformat(user.get("created_at").replace('Z', '+00:00')) if user.get("created_at") else None
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=error_msg
                 )
-            except HTTPException:
-                raise
-            except Exception as e:
+
+            data = read_json(response)
+            
+            if not data:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Error creating user: {str(e)}"
+                    detail="Failed to create user"
                 )
 
+            # Signup returns the user itself, or a session wrapping it when
+            # email confirmation is disabled
+            user = data.get("user") or data
+            # Only the id is logged; a session response also carries tokens
+            logger.debug("Signed up user %s", user.get("id"))
+            
+            return _build_user_response(
+                user,
+                full_name=user_data.full_name,
+                phone=user_data.phone
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error creating user: {str(e)}"
+            )
+
     async def authenticate_user(self, login_data: UserLogin) -> dict:
         """Authenticate user and return access token."""
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{self.supabase_url}/auth/v1/token?grant_type=password",
-                    headers={
-                        "apikey": self.supabase_key,
-                        "Content-Type": "application/json",
-                    },
-                    json={
-                        "email": login_data.email,
-                        "password": login_data.password
-                    },
-                )
-
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        detail="Invalid email or password"
-                    )
+        try:
+            response = await get_http_client().post(
+                f"{self.supabase_url}/auth/v1/token?grant_type=password",
+                headers=self._anon_headers,
+                content=orjson.dumps({
+                    "email": login_data.email,
+                    "password": login_data.password
+                }),
+            )
 
-                data = response.json()
-                user = data.get("user", {})
-                access_token = data.get("access_token")
-                
-                if not user or not access_token:
-                    raise HTTPException(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        detail="Invalid email or password"
-                    )
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid email or password"
+                )
 
-                user_metadata = user.get("user_metadata", {})
-                
-                return {
-                    "access_token": access_token,
-                    "token_type": "bearer",
-                    "user": UserResponse(
-                        id=user.get("id"),
-                        email=user.get("email"),
-                        full_name=user_metadata.get("full_name"),
-                        phone=user_metadata.get("phone"),
-                        created_at=datetime.fromisoformat(user.get("created_at").replace('Z', '+00:00')) if user.get("created_at") else None
-                    )
-                }
-            except HTTPException:
-                raise
-            except Exception as e:
+            data = read_json(response)
+            user = data.get("user", {})
+            access_token = data.get("access_token")
+            
+            if not user or not access_token:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Invalid email or password"
                 )
 
+            return {
+                "access_token": access_token,
+                "token_type": "bearer",
+                "user": _build_user_response(user)
+            }
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid email or password"
+            )
+
     async def get_user(self, user_id: str) -> UserResponse:
         """Get user by ID (admin operation)."""
         if not self.service_role_key:
@@ -135,40 +188,39 @@ class UserService:
                 detail="Service role key is required for this operation"
             )
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.supabase_url}/auth/v1/admin/users/{user_id}",
-                    headers={
-                        "apikey": self.service_role_key,
-                        "Authorization": f"Bearer {self.service_role_key}",
-                    },
-                )
+        cached = self._user_cache.get(user_id)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self._user_cache.move_to_end(user_id)
+                return cached[1]
+            self._user_cache.pop(user_id, None)
 
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail="User not found"
-                    )
+        generation = self._cache_generation
+        try:
+            response = await get_http_client().get(
+                f"{self.supabase_url}/auth/v1/admin/users/{user_id}",
+                headers=self._admin_headers,
+            )
 
-                user = response.json()
-                user_metadata = user.get("user_metadata", {})
-                
-                return UserResponse(
-                    id=user.get("id"),
-                    email=user.get("email"),
-                    full_name=user_metadata.get("full_name"),
-                    phone=user_metadata.get("phone"),
-                    created_at=datetime.fromisoformat(user.get("created_at").replace('Z', '+00:00')) if user.get("created_at") else None
-                )
-            except HTTPException:
-                raise
-            except Exception as e:
+            if response.status_code != 200:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="User not found"
                 )
 
+            user = _build_user_response(read_json(response))
+            if generation == self._cache_generation:
+                self._cache_user(user_id, user)
+
+            return user
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+
     async def update_user(self, user_id: str, user_data: UserUpdate) -> UserResponse:
         """Update user information (admin operation)."""
         if not self.service_role_key:
@@ -177,69 +229,63 @@ class UserService:
                 detail="Service role key is required for this operation"
             )
 
-        async with httpx.AsyncClient() as client:
-            try:
-                update_payload = {}
-                
-                if user_data.email:
-                    update_payload["email"] = user_data.email
-                
-                if user_data.password:
-                    update_payload["password"] = user_data.password
-                
-                # Update user metadata
-                metadata = {}
-                if user_data.full_name is not None:
-                    metadata["full_name"] = user_data.full_name
-                if user_data.phone is not None:
-                    metadata["phone"] = user_data.phone
-                
-                if metadata:
-                    update_payload["user_metadata"] = metadata
+        try:
+            update_payload = {}
+            
+            if user_data.email:
+                update_payload["email"] = user_data.email
+            
+            if user_data.password:
+                update_payload["password"] = user_data.password
+            
+            # Update user metadata
+            metadata = {}
+            if user_data.full_name is not None:
+                metadata["full_name"] = user_data.full_name
+            if user_data.phone is not None:
+                metadata["phone"] = user_data.phone
+            
+            if metadata:
+                update_payload["user_metadata"] = metadata
 
-                response = await client.put(
+            try:
+                response = await get_http_client().put(
                     f"{self.supabase_url}/auth/v1/admin/users/{user_id}",
-                    headers={
-                        "apikey": self.service_role_key,
-                        "Authorization": f"Bearer {self.service_role_key}",
-                        "Content-Type": "application/json",
-                    },
-                    json=update_payload,
+                    headers=self._admin_write_headers,
+                    content=orjson.dumps(update_payload),
                 )
+            finally:
+                # Invalidate only once the write has landed, so a concurrent
+                # get_user cannot put the old record back
+                self._invalidate_user(user_id)
 
-                if response.status_code != 200:
-                    error_data = response.json() if response.content else {}
-                    error_msg = error_data.get("msg", "Failed to update user")
-                    
-                    if "not found" in error_msg.lower():
-                        raise HTTPException(
-                            status_code=status.HTTP_404_NOT_FOUND,
-                            detail="User not found"
-                        )
-                    
+            if response.status_code != 200:
+                error_data = read_json(response)
+                error_msg = error_data.get("msg", "Failed to update user")
+                
+                if "not found" in error_msg.lower():
                     raise HTTPException(
-                        status_code=response.status_code,
-                        detail=error_msg
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="User not found"
                     )
-
-                user = response.json()
-                user_metadata = user.get("user_metadata", {})
                 
-                return UserResponse(
-                    id=user.get("id"),
-                    email=user.get("email"),
-                    full_name=user_metadata.get("full_name"),
-                    phone=user_metadata.get("phone"),
-                    created_at=datetime.fromisoformat(user.get("created_at").replace('Z', '+00:00')) if user.get("created_at") else None
-                )
-            except HTTPException:
-                raise
-            except Exception as e:
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Error updating user: {str(e)}"
+                    status_code=response.status_code,
+                    detail=error_msg
                 )
 
+            user = _build_user_response(read_json(response))
+            self._cache_user(user_id, user)
+
+            return user
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error updating user: {str(e)}"
+            )
+
     async def delete_user(self, user_id: str) -> dict:
         """Delete a user (admin operation)."""
         if not self.service_role_key:
@@ -248,36 +294,37 @@ class UserService:
                 detail="Service role key is required for this operation"
             )
 
-        async with httpx.AsyncClient() as client:
+        try:
             try:
-                response = await client.delete(
+                response = await get_http_client().delete(
                     f"{self.supabase_url}/auth/v1/admin/users/{user_id}",
-                    headers={
-                        "apikey": self.service_role_key,
-                        "Authorization": f"Bearer {self.service_role_key}",
-                    },
+                    headers=self._admin_headers,
                 )
+            finally:
+                # Invalidate only once the delete has landed, so a concurrent
+                # get_user cannot put the deleted record back
+                self._invalidate_user(user_id)
 
-                if response.status_code not in [200, 204]:
-                    error_data = response.json() if response.content else {}
-                    error_msg = error_data.get("msg", "Failed to delete user")
-                    
-                    if "not found" in error_msg.lower():
-                        raise HTTPException(
-                            status_code=status.HTTP_404_NOT_FOUND,
-                            detail="User not found"
-                        )
-                    
+            if response.status_code not in [200, 204]:
+                error_data = read_json(response)
+                error_msg = error_data.get("msg", "Failed to delete user")
+                
+                if "not found" in error_msg.lower():
                     raise HTTPException(
-                        status_code=response.status_code,
-                        detail=error_msg
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="User not found"
                     )
-
-                return {"message": "User deleted successfully", "user_id": user_id}
-            except HTTPException:
-                raise
-            except Exception as e:
+                
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Error deleting user: {str(e)}"
+                    status_code=response.status_code,
+                    detail=error_msg
                 )
+
+            return {"message": "User deleted successfully", "user_id": user_id}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Error deleting user: {str(e)}"
+            )